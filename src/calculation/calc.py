@@ -1,5 +1,6 @@
 # coding=utf-8
 
+import functools
 import logging
 import os
 import re
@@ -8,6 +9,8 @@ from datetime import datetime
 
 import calculators
 import hydra
+import sessions
+import vibrations
 from ase.db import connect
 from ase.io import read, write
 from omegaconf import DictConfig
@@ -159,6 +162,8 @@ def run_calc(
     kpoints,
     cutoff,
     lattice_opt,
+    settings=None,
+    session=None,
 ):
     """
     Run the calculation using the specified calculator.
@@ -176,22 +181,37 @@ def run_calc(
         kpoints (tuple): The k-points for the calculation.
         cutoff (float): The cutoff energy for the calculation.
         lattice_opt (bool): Whether to perform lattice optimization.
+        settings (dict): Extra calculator settings, e.g. a step of the escalation ladder.
+        session (CalculatorSession): Persistent calculator process to reuse, if any.
 
 
     Returns:
-    - opt_atoms: Optimized atoms object.
+    - opt_atoms: Optimized atoms object, or None if the calculation failed.
+    - error (str): The error message if the calculation failed, otherwise None.
     """
 
     logging.info(f"\t\tPerforming an {calc_type} calculation in {calculator}")
 
     try:
-        if calculator.lower() == "dftb":
+        if session is not None and not settings and session.supports(calc_type, lattice_opt):
+            opt_atoms = session.run(atoms, label, calc_type)
+        elif calculator.lower() == "dftb":
             opt_atoms = calculators.DFTB_calculator(
-                atoms, label, calc_type, parametrization, kpoints, lattice_opt
+                atoms, label, calc_type, parametrization, kpoints, lattice_opt, settings
+            )
+        elif calculator.lower() == "xtb":
+            opt_atoms = calculators.xTB_calculator(
+                atoms, label, calc_type, parametrization, lattice_opt, settings
             )
         elif calculator.lower() == "gaussian":
             opt_atoms = calculators.Gaussian_calculator(
-                atoms, label, calc_type, functional, dispersion_correction, basis_set
+                atoms,
+                label,
+                calc_type,
+                functional,
+                dispersion_correction,
+                basis_set,
+                settings,
             )
         elif calculator.lower() == "vasp":
             opt_atoms = calculators.VASP_calculator(
@@ -203,17 +223,108 @@ def run_calc(
                 kpoints,
                 cutoff,
                 lattice_opt,
+                settings,
             )
         else:
             raise ValueError(f"Unsupported calculator: {calculator}")
 
     except Exception as e:
         logging.error(f"\t\tError in run_calc for {calculator} calculation: {str(e)}")
-        return None
+        return None, str(e)
 
-    return opt_atoms
+    return opt_atoms, None
 
-def save_to_database(row, opt_atoms, calculation_label, calc_type, opt_db, counter):
+def run_vib(
+    calculator,
+    atoms,
+    label,
+    functional,
+    dispersion_correction,
+    basis_set,
+    parametrization,
+    kpoints,
+    cutoff,
+    lattice_opt,
+    settings=None,
+    delta=0.01,
+    workers=None,
+    vib_dir="vib",
+):
+    """
+    Run a finite-difference vibrational analysis using the specified calculator.
+
+    Gaussian and VASP already use the whole allocation for one calculation,
+    so they run one displacement at a time unless workers is given. Gaussian
+    then gets an equal share of the CPUs through nprocshared; VASP is always
+    run with one worker, since mpprun launches on the whole allocation.
+
+    Args:
+        delta (float): Displacement in Å.
+        workers (int): Number of parallel single points (Default: all CPUs
+            for DFTB and xTB, 1 for Gaussian and VASP).
+        vib_dir (str): Folder for the displacements and their cache.
+        Remaining arguments as in run_calc.
+
+    Returns:
+    - eq_atoms: Atoms object with single-point results at the input geometry.
+    - data (dict): Compact Hessian, frequencies and modes for the row data.
+    - error (str): The error message if the analysis failed, otherwise None.
+    """
+
+    if calculator.lower() in ("gaussian", "vasp") and workers is None:
+        workers = 1
+    if calculator.lower() == "vasp" and workers > 1:
+        logging.warning("\t\tVASP displacements run with 1 worker, since mpprun uses all CPUs")
+        workers = 1
+
+    worker_settings = settings
+    if calculator.lower() == "gaussian" and workers > 1:
+        cpus = max(1, vibrations.available_cpus() // workers)
+        worker_settings = {**(settings or {}), "nprocshared": str(cpus)}
+
+    evaluate = functools.partial(
+        run_calc,
+        calculator=calculator,
+        calc_type="sp",
+        functional=functional,
+        dispersion_correction=dispersion_correction,
+        basis_set=basis_set,
+        parametrization=parametrization,
+        kpoints=kpoints,
+        cutoff=cutoff,
+        lattice_opt=lattice_opt,
+        settings=settings,
+    )
+
+    eq_atoms, error = evaluate(atoms=atoms.copy(), label=label)
+    if eq_atoms is None:
+        return None, None, error
+
+    try:
+        vib_data = vibrations.run_vibrations(
+            atoms,
+            functools.partial(evaluate, settings=worker_settings),
+            delta,
+            workers,
+            directory=vib_dir,
+        )
+    except Exception as e:
+        logging.error(f"\t\tError in run_vib for {calculator} calculation: {str(e)}")
+        return None, None, str(e)
+
+    return eq_atoms, vibrations.compact_data(vib_data, delta), None
+
+
+def save_to_database(
+    row,
+    opt_atoms,
+    calculation_label,
+    calc_type,
+    opt_db,
+    counter,
+    converged=True,
+    data=None,
+):
 
     try:
         foreign_key = counter if row is None else row.get("foreignkey", row.id)
@@ -222,6 +333,9 @@ def save_to_database(row, opt_atoms, calculation_label, calc_type, opt_db, count
             foreignkey=foreign_key,
             name=calculation_label,
             calc_type=calc_type,
+            converged=converged,
+            attempts=len(data.get("attempts", [{}])) if data else 1,
+            data=data,
         )
         logging.info(
             f"Wrote optimized structure to database {opt_db} with "
@@ -250,6 +364,9 @@ def optimize_atoms(
     cutoff,
     lattice_opt,
     counter,
+    session=None,
+    vib_delta=0.01,
+    vib_workers=None,
 ):
     """
     Optimize structures and save them to a new database.
@@ -259,7 +376,7 @@ def optimize_atoms(
     - row: Database row for the current atom (used for foreign key).
     - opt_db: Database object to save the optimized structures.
     - calculator (str): Calculator name.
-    - calc_type (str): Calculation type, either "sp" for single-point or "opt" for optimization.
+    - calc_type (str): Calculation type, "sp" for single-point, "opt" for optimization or "vib" for vibrational analysis.
     - calculation_label (str): Label for the calculation.
     - functional (str): Functional used for the calculation.
     - dispersion_correction (str): Dispersion correction applied.
@@ -269,45 +386,189 @@ def optimize_atoms(
     - cutoff (float): Cutoff energy for the calculation.
     - lattice_opt (str): Type of lattice optimization ("lattice" or "atomic").
     - counter (int): Counter for unique labeling.
+    - session (CalculatorSession): Persistent calculator process to reuse, if any.
+    - vib_delta (float): Displacement in Å for vibrational analysis.
+    - vib_workers (int): Number of parallel single points for vibrational analysis.
+
+    Returns:
+    - bool: True if the calculation succeeded, False if the structure was
+      queued for retry.
     """
             
     logging.info("-" * 40)
     logging.info(f"Calculating {calculation_label}")
     
+    cwd = os.getcwd()
     output_folder = create_folder(calculation_label)
     os.chdir(output_folder)
     
-    opt_atoms = run_calc(
-        calculator,
-        input_atom,
-        calculation_label,
-        calc_type,
-        functional,
-        dispersion_correction,
-        basis_set,
-        parametrization,
-        kpoints,
-        cutoff,
-        lattice_opt,
+    data = None
+    if calc_type.lower() == "vib":
+        opt_atoms, data, error = run_vib(
+            calculator,
+            input_atom.copy(),
+            calculation_label,
+            functional,
+            dispersion_correction,
+            basis_set,
+            parametrization,
+            kpoints,
+            cutoff,
+            lattice_opt,
+            delta=vib_delta,
+            workers=vib_workers,
         )
+    else:
+        opt_atoms, error = run_calc(
+            calculator,
+            input_atom.copy(),
+            calculation_label,
+            calc_type,
+            functional,
+            dispersion_correction,
+            basis_set,
+            parametrization,
+            kpoints,
+            cutoff,
+            lattice_opt,
+            session=session,
+            )
         
     if opt_atoms is not None:
         logging.info(f"\t\tOptimized {calculation_label}!")
+        save_to_database(
+            row, opt_atoms, calculation_label, calc_type, opt_db, counter, data=data
+        )
     else:
         logging.error(
             f"\t\tError in optimize_atoms for {calculation_label}: atoms is None."
         )
+        # Keep the input structure in the retry queue instead of losing it. The
+        # backends work on a copy, so this is the original geometry without
+        # results from the failed run.
+        save_to_database(
+            row,
+            input_atom.copy(),
+            calculation_label,
+            calc_type,
+            opt_db,
+            counter,
+            converged=False,
+            data={"attempts": [{"settings": {}, "converged": False, "error": error}]},
+        )
 
-    save_to_database(row, opt_atoms, calculation_label, calc_type, opt_db, counter)
+    os.chdir(cwd)
 
-    os.chdir(os.path.join("..", ".."))
+    return opt_atoms is not None
 
-    if opt_atoms is not None:
-        logging.info(f"\t\tOptimized {calculation_label}!")
-    else:
-        logging.error(
-            f"\t\tError in optimize_atoms for {calculation_label}: atoms is None."
+
+def process_retry_queue(
+    opt_db,
+    calculator,
+    calc_type,
+    functional,
+    dispersion_correction,
+    basis_set,
+    parametrization,
+    kpoints,
+    cutoff,
+    lattice_opt,
+    max_retries,
+    vib_delta=0.01,
+    vib_workers=None,
+):
+    """
+    Retry failed structures with escalating convergence settings.
+
+    Rows written with converged=False are rerun with the next step of the
+    calculator's escalation ladder until they converge or the ladder (or
+    max_retries) is exhausted. The attempt history is stored in the row data.
+
+    Args:
+    - opt_db: Database object holding the queued structures.
+    - max_retries (int): Maximum number of retries per structure.
+    - Remaining arguments as in optimize_atoms.
+
+    Returns:
+    - int: Number of structures that are still unconverged.
+    """
+
+    ladder = calculators.ESCALATION_LADDERS.get(calculator.lower(), [])
+    failed_rows = list(opt_db.select(converged=False, calc_type=calc_type))
+    logging.info("-" * 40)
+    logging.info(f"Processing retry queue with {len(failed_rows)} structures")
+
+    remaining = 0
+    for row in failed_rows:
+        attempts = list(
+            row.data.get("attempts", [{"settings": {}, "converged": False, "error": None}])
         )
+        opt_atoms = None
+        vib_data = {}
+
+        while opt_atoms is None and len(attempts) <= min(max_retries, len(ladder)):
+            settings = ladder[len(attempts) - 1]
+            logging.info(
+                f"\t\tRetry {len(attempts)} of {row.name} with settings {settings}"
+            )
+
+            cwd = os.getcwd()
+            # The ladder only changes SCF convergence aids, so vib retries reuse
+            # the displacements already cached by earlier attempts.
+            vib_dir = os.path.abspath(os.path.join("./outputs", row.name, "vib"))
+            os.chdir(create_folder(os.path.join(row.name, f"retry_{len(attempts)}")))
+            if calc_type.lower() == "vib":
+                opt_atoms, vib_data, error = run_vib(
+                    calculator,
+                    row.toatoms(),
+                    row.name,
+                    functional,
+                    dispersion_correction,
+                    basis_set,
+                    parametrization,
+                    kpoints,
+                    cutoff,
+                    lattice_opt,
+                    settings,
+                    delta=vib_delta,
+                    workers=vib_workers,
+                    vib_dir=vib_dir,
+                )
+            else:
+                opt_atoms, error = run_calc(
+                    calculator,
+                    row.toatoms(),
+                    row.name,
+                    calc_type,
+                    functional,
+                    dispersion_correction,
+                    basis_set,
+                    parametrization,
+                    kpoints,
+                    cutoff,
+                    lattice_opt,
+                    settings,
+                )
+            os.chdir(cwd)
+            attempts.append(
+                {"settings": settings, "converged": opt_atoms is not None, "error": error}
+            )
+
+        if opt_atoms is not None:
+            opt_db.update(
+                row.id,
+                atoms=opt_atoms,
+                converged=True,
+                attempts=len(attempts),
+                data={"attempts": attempts, **(vib_data or {})},
+            )
+            logging.info(f"\t\tOptimized {row.name} after {len(attempts)} attempts!")
+        else:
+            opt_db.update(row.id, attempts=len(attempts), data={"attempts": attempts})
+            logging.error(f"\t\tRetry queue exhausted for {row.name}.")
+            remaining += 1
+
+    return remaining
 
 
 @hydra.main(version_base=None, config_path="../config/", config_name="config.yaml")
@@ -356,23 +617,50 @@ def main(cfg: DictConfig) -> None:
         calc_label = calc_label.replace('.xyz', '').replace('.vasp','')
         calculation_labels.append(f"{calc_label}")
 
-    for i, (atom, calc_label) in enumerate(zip(input_atoms, calculation_labels)):
-        optimize_atoms(
-            input_atom=atom,
-            row=rows[i] if rows else None,
-            opt_db=opt_db,
-            calculator=job.calculator,
-            calc_type=job.calc_type,
-            calculation_label=calc_label,
+    calc_params = dict(
+        calculator=job.calculator,
+        calc_type=job.calc_type,
+        functional=job.functional,
+        dispersion_correction=job.dispersion_correction,
+        basis_set=job.basis_set,
+        parametrization=parametrization,
+        kpoints=tuple(job.kpoints) if job.kpoints is not None else (),
+        cutoff=job.encut,
+        lattice_opt=job.lattice_opt,
+        vib_delta=job.vib_delta,
+        vib_workers=job.vib_workers,
+    )
+
+    session = None
+    if job.session:
+        session = sessions.CalculatorSession(
+            job.calculator,
+            parametrization=parametrization,
             functional=job.functional,
             dispersion_correction=job.dispersion_correction,
-            basis_set=job.basis_set,
-            parametrization=parametrization,
-            kpoints=tuple(job.kpoints) if job.kpoints is not None else (),
+            kpoints=calc_params["kpoints"],
             cutoff=job.encut,
-            lattice_opt=job.lattice_opt,
-            counter=i+1,
-            )
+        )
+
+    retry = str(job.retry).lower()
+    try:
+        if retry != "only":
+            for i, (atom, calc_label) in enumerate(zip(input_atoms, calculation_labels)):
+                optimize_atoms(
+                    input_atom=atom,
+                    row=rows[i] if rows else None,
+                    opt_db=opt_db,
+                    calculation_label=calc_label,
+                    counter=i+1,
+                    session=session,
+                    **calc_params,
+                    )
+    finally:
+        if session is not None:
+            session.close()
+
+    if retry in ("end", "only"):
+        process_retry_queue(opt_db, max_retries=job.max_retries, **calc_params)
 
     setup_end_time(start, calc_label)
     print(f"Ending job with label {calc_label}.")
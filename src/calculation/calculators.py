@@ -5,10 +5,57 @@ import os
 from ase.calculators.dftb import Dftb
 from ase.calculators.gaussian import Gaussian, GaussianOptimizer
 from ase.calculators.vasp import Vasp
+from ase.filters import FrechetCellFilter
 from ase.io import read
+from ase.optimize import BFGS
 
+# Damped Anderson mixing for SCC cycles that oscillate with the default mixer.
+DFTB_MIXER_PARAMS = {
+    "Hamiltonian_Mixer":'Anderson{',
+    "Hamiltonian_Mixer_MixingParameter":'0.010',
+    "Hamiltonian_Mixer_Generations" :'4', 
+    "Hamiltonian_Mixer_InitMixingParameter" :'0.010',
+    "Hamiltonian_Mixer_DynMixingParameters" :'{1.0e-2 0.01 1.0e-3 0.1 1.0e-5 0.3}',
+    "Hamiltonian_Mixer_DiagonalRescaling" : '0.03',
+}
 
-def DFTB_calculator(atoms, label, calc_type, parametrization, kpts, lattice_opt):
+# Settings applied on successive retries of a failed structure, one dict per attempt.
+ESCALATION_LADDERS = {
+    "dftb": [
+        {**DFTB_MIXER_PARAMS},
+        {**DFTB_MIXER_PARAMS, "Hamiltonian_MaxSCCIterations": 1000},
+    ],
+    "gaussian": [
+        {"scf": "xqc,maxcycle=500"},
+        {"scf": "xqc,maxcycle=1000"},
+    ],
+    "xtb": [
+        {"mixer_damping": 0.1, "max_iterations": 1000},
+        {"mixer_damping": 0.05, "max_iterations": 2000},
+    ],
+    "vasp": [
+        {"algo": "all", "nelm": 1000},
+        {"algo": "damped", "nelm": 1500, "time": 0.5},
+    ],
+}
+
+
+def DFTB_parameters(label, parametrization):
+    """Return the DFTB+ xTB Hamiltonian parameters shared by all DFTB runs."""
+
+    return {
+        "kpts": (1, 1, 1),
+        "label": label,
+        "Hamiltonian_": "xTB",
+        "Hamiltonian_Method": f"{parametrization}-xTB",
+        "Hamiltonian_MaxSCCIterations":500,
+        # Hamiltonian_SCCTolerance=1e-5,
+    }
+
+
+def DFTB_calculator(
+    atoms, label, calc_type, parametrization, kpts, lattice_opt, settings=None
+):
     """
     Run a DFTB calculation.
 
@@ -19,30 +66,16 @@ def DFTB_calculator(atoms, label, calc_type, parametrization, kpts, lattice_opt)
         parametrization (str): Parametrization used in the calculation.
         kpts (tuple): k-points used in the calculation.
         lattice_opt (str): Flag indicating whether lattice optimization is enabled.
+        settings (dict): Extra DFTB+ parameters, e.g. from ESCALATION_LADDERS.
 
     Returns:
         ase.Atoms: The atomic structure with calculation results.
     """
 
-    common_params = {
-        "atoms": atoms,
-        "kpts": (1, 1, 1),
-        "label": label,
-        "Hamiltonian_": "xTB",
-        "Hamiltonian_Method": f"{parametrization}-xTB",
-        "Hamiltonian_MaxSCCIterations":500,
-        # Hamiltonian_SCCTolerance=1e-5,
-    }
-    
-    mixer_params = {
-        "Hamiltonian_Mixer":'Anderson{',
-        "Hamiltonian_Mixer_MixingParameter":'0.010',
-        "Hamiltonian_Mixer_Generations" :'4', 
-        "Hamiltonian_Mixer_InitMixingParameter" :'0.010',
-        "Hamiltonian_Mixer_DynMixingParameters" :'{1.0e-2 0.01 1.0e-3 0.1 1.0e-5 0.3}',
-        "Hamiltonian_Mixer_DiagonalRescaling" : '0.03',
-    }
+    settings = settings or {}
 
+    common_params = {"atoms": atoms, **DFTB_parameters(label, parametrization)}
+    
     opt_params = {
         "Driver_": "GeometryOptimization",
         "Driver_Optimiser": "Rational {}",
@@ -50,7 +83,7 @@ def DFTB_calculator(atoms, label, calc_type, parametrization, kpts, lattice_opt)
     }
 
     if calc_type.lower() == "opt":
-        calc_params = {**common_params, **opt_params}
+        calc_params = {**common_params, **opt_params, **settings}
         
         # perform opt:
         os.makedirs("./opt", exist_ok=True)
@@ -60,23 +93,68 @@ def DFTB_calculator(atoms, label, calc_type, parametrization, kpts, lattice_opt)
         atoms.get_potential_energy()
         
     else:
-        # calc_params = {**common_params, **mixer_params}
-        calc_params = {**common_params}
+        calc_params = {**common_params, **settings}
+        calc = Dftb(**calc_params)
 
     # perform sp:
+    is_opt = calc_type.lower() == "opt"
     os.makedirs("./sp", exist_ok=True)
     os.chdir("./sp")
-    opt_atoms = read("../geo_end.gen")
+    opt_atoms = read("../geo_end.gen") if is_opt else atoms.copy()
     opt_atoms.calc = calc
     opt_atoms.get_forces()
     opt_atoms.get_potential_energy()
     opt_atoms.get_charges()
-    os.chdir(os.path.join("..", ".."))
+    os.chdir(os.path.join("..", "..") if is_opt else "..")
 
     return opt_atoms
 
+def xTB_calculator(atoms, label, calc_type, parametrization, lattice_opt, settings=None):
+    """
+    Run a GFN-xTB calculation in-process through the tblite Python library.
+
+    Unlike DFTB_calculator, no input files are written and no external
+    process is started; the optimization is driven by an ASE optimizer.
+
+    Args:
+        atoms (ase.Atoms): The atomic structure for the calculation.
+        label (str): Label for the calculation.
+        calc_type (str): Type of calculation, either 'opt' for optimization or 'sp' for single-point.
+        parametrization (str): Parametrization used in the calculation ("GFN1", "GFN2").
+        lattice_opt (str): Flag indicating whether lattice optimization is enabled.
+        settings (dict): Extra tblite parameters, e.g. from ESCALATION_LADDERS.
+
+    Returns:
+        ase.Atoms: The atomic structure with calculation results.
+    """
+
+    # Only needed for xTB jobs, so tblite is not required for the other calculators.
+    from tblite.ase import TBLite
+
+    calc_params = {
+        "method": f"{parametrization}-xTB",
+        "max_iterations": 500,
+        "verbosity": 0,
+        **(settings or {}),
+    }
+
+    atoms.calc = TBLite(**calc_params)
+
+    if calc_type.lower() == "opt":
+        # fmax matches the default DFTB+ MaxForceComponent of 1e-4 Hartree/Bohr.
+        lattice = lattice_opt and lattice_opt.lower() == "yes"
+        opt = BFGS(FrechetCellFilter(atoms) if lattice else atoms, logfile=f"{label}.log")
+        if not opt.run(fmax=0.005, steps=500):
+            raise RuntimeError(f"xTB optimization of {label} did not converge in 500 steps")
+
+    atoms.get_forces()
+    atoms.get_potential_energy()
+    atoms.get_charges()
+
+    return atoms
+
 def Gaussian_calculator(
-    atoms, label, calc_type, functional, dispersion_correction, basis_set
+    atoms, label, calc_type, functional, dispersion_correction, basis_set, settings=None
 ):
     """
     Run a Gaussian calculation.
@@ -87,6 +165,7 @@ def Gaussian_calculator(
         calc_type (str): Type of calculation, either 'opt' for optimization or 'sp' for single-point.
         functional (str): Functional used in the calculation.
         basis_set (str): Basis set used in the calculation.
+        settings (dict): Extra Gaussian keywords, e.g. from ESCALATION_LADDERS.
 
     Returns:
         ase.Atoms: The atomic structure with calculation results.
@@ -98,7 +177,7 @@ def Gaussian_calculator(
     if not gaussian_executable:
         gaussian_executable = "g16"
 
-    calc = Gaussian(
+    calc_params = dict(
         label=label,
         mem="12GB",
         nprocshared="12",
@@ -112,6 +191,8 @@ def Gaussian_calculator(
         pop="chelpg",
         command=f"{gaussian_executable} < PREFIX.com > PREFIX.log",
     )
+    calc_params.update(settings or {})
+    calc = Gaussian(**calc_params)
 
     atoms.calc = calc
     
@@ -125,6 +206,27 @@ def Gaussian_calculator(
     return atoms
 
 
+def VASP_parameters(functional, dispersion_correction, kpts, cutoff):
+    """Return the VASP electronic-structure parameters shared by all VASP runs."""
+
+    return dict(
+        algo="normal",
+        xc=functional,
+        prec="ACCURATE",
+        istart=1,
+        icharg=1,
+        ispin=1,
+        ivdw=11 if dispersion_correction.upper() in ["D3", "GD3"] else 0,
+        kpts=kpts,
+        lorbit=None,
+        ediff=0.1e-06,
+        nelm=600,
+        encut=cutoff if cutoff else 500,
+        sigma=0.05,
+        ismear=0,
+    )
+
+
 def VASP_calculator(
     atoms,
     label,
@@ -134,6 +236,7 @@ def VASP_calculator(
     kpts,
     cutoff,
     lattice_opt,
+    settings=None,
 ):
     """
     Run a VASP calculation.
@@ -144,6 +247,7 @@ def VASP_calculator(
         calc_type (str): Type of calculation, either 'opt' for optimization or 'sp' for single-point.
         functional (str): Type of functional for the calculation.
         lattice_opt (str): Flag indicating whether lattice optimization is enabled.
+        settings (dict): Extra INCAR parameters, e.g. from ESCALATION_LADDERS.
 
     Returns:
         ase.Atoms: The atomic structure with calculation results.
@@ -159,30 +263,19 @@ def VASP_calculator(
         else ""
     )
 
-    calc = Vasp(
+    calc_params = dict(
         atoms=atoms,
         label=label,
         txt="vasp_out",
         command="mpprun vasp_std",
-        algo="normal",
-        xc=functional,
-        prec="ACCURATE",
-        istart=1,
-        icharg=1,
-        ispin=1,
-        ivdw=11 if dispersion_correction.upper() in ["D3", "GD3"] else 0,
-        kpts=kpts,
-        lorbit=None,
-        ediff=0.1e-06,
+        **VASP_parameters(functional, dispersion_correction, kpts, cutoff),
         ediffg=-0.1e-2,
-        nelm=600,
-        encut=cutoff if cutoff else 500,
-        sigma=0.05,
-        ismear=0,
         nsw=500 if calc_type.lower() == "opt" else 1,
         ibrion=2,
         isif=3 if lattice_opt == "yes" else 2,
     )
+    calc_params.update(settings or {})
+    calc = Vasp(**calc_params)
 
     atoms.calc = calc
     atoms.get_potential_energy()
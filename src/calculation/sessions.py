@@ -0,0 +1,204 @@
+# coding=utf-8
+
+import logging
+import os
+
+import calculators
+from ase.calculators.dftb import Dftb
+from ase.calculators.singlepoint import SinglePointCalculator
+from ase.calculators.socketio import SocketIOCalculator
+from ase.calculators.vasp import VaspInteractive
+from ase.optimize import BFGS
+
+# Force thresholds (eV/Å) matching the per-structure calculators.
+FMAX = {"dftb": 0.005, "vasp": 0.001}
+
+# Results kept on the returned atoms. The i-PI protocol and VASP's interactive
+# mode only return energy, forces and stress, so charges are not available.
+RESULT_PROPERTIES = ("energy", "free_energy", "forces", "stress", "charges")
+
+
+class CalculatorSession:
+    """
+    Keep one DFTB+ or VASP process alive for a sequence of geometries.
+
+    DFTB+ is driven through ASE's socket I/O (i-PI protocol) and VASP through
+    ASE's interactive mode. Both only send positions (and the cell) to the
+    running process, so it is reused as long as the atomic numbers in order,
+    the cell and periodicity stay the same; otherwise it is closed and a new
+    one is launched. If the connection is lost or the process has died, the
+    process is relaunched once.
+
+    Args:
+        calculator (str): The name of the calculator ("dftb" or "vasp").
+        parametrization (str): The parametrization for DFTB.
+        functional (str): The functional for VASP.
+        dispersion_correction (str): The dispersion correction method for VASP.
+        kpoints (tuple): The k-points for VASP.
+        cutoff (float): The cutoff energy for VASP.
+        launch_client (callable): Optional socket client launcher passed to
+            SocketIOCalculator instead of starting dftb+, e.g. a local
+            ase.calculators.socketio.SocketClient for testing.
+        vasp_command (str): Command that starts VASP (Default: "mpprun vasp_std").
+    """
+
+    def __init__(
+        self,
+        calculator,
+        parametrization=None,
+        functional=None,
+        dispersion_correction=None,
+        kpoints=(),
+        cutoff=None,
+        launch_client=None,
+        vasp_command="mpprun vasp_std",
+    ):
+        self.calculator = calculator.lower()
+        if self.calculator not in FMAX:
+            raise ValueError(f"Unsupported session calculator: {calculator}")
+
+        self.parametrization = parametrization
+        self.functional = functional
+        self.dispersion_correction = dispersion_correction or ""
+        self.kpoints = kpoints
+        self.cutoff = cutoff
+        self.launch_client = launch_client
+        self.vasp_command = vasp_command
+
+        self.calc = None
+        self.key = None
+        self.launches = 0
+
+    @staticmethod
+    def session_key(atoms):
+        """Return the species order and cell settings a live process is bound to."""
+        return (
+            tuple(atoms.numbers),
+            tuple(atoms.cell.array.round(6).ravel()),
+            tuple(atoms.pbc),
+        )
+
+    def supports(self, calc_type, lattice_opt):
+        """Return whether a calculation can run in the session."""
+        lattice = lattice_opt and str(lattice_opt).lower() == "yes"
+        return calc_type.lower() in ("opt", "sp") and not lattice
+
+    def _launch(self, atoms):
+        """Start a new process in a session folder under the current directory."""
+
+        self.launches += 1
+        directory = os.path.abspath(f"session_{self.launches}")
+        os.makedirs(directory, exist_ok=True)
+        logging.info(f"\t\tLaunching {self.calculator} session in {directory}")
+
+        if self.calculator == "dftb":
+            unixsocket = f"dftb_session_{os.getpid()}_{self.launches}"
+            if self.launch_client is not None:
+                self.calc = SocketIOCalculator(
+                    unixsocket=unixsocket, launch_client=self.launch_client
+                )
+            else:
+                dftb = Dftb(
+                    **calculators.DFTB_parameters(
+                        os.path.join(directory, "dftb"), self.parametrization
+                    ),
+                    Driver_="",
+                    Driver_Socket_="",
+                    Driver_Socket_File=unixsocket,
+                    Driver_Socket_MaxSteps=100000,
+                )
+                self.calc = SocketIOCalculator(dftb, unixsocket=unixsocket)
+
+        else:
+            self.calc = VaspInteractive(
+                path=directory,
+                txt=os.path.join(directory, "vasp_out"),
+                command=self.vasp_command,
+                **calculators.VASP_parameters(
+                    self.functional, self.dispersion_correction, self.kpoints, self.cutoff
+                ),
+                nsw=100000,
+            )
+            # VaspInteractive skips Calculator.__init__, which sets these attributes.
+            self.calc.use_cache = False
+            self.calc.directory = directory
+
+        self.key = self.session_key(atoms)
+
+    def _alive(self):
+        """Return whether the VASP process, if one was started, is still running."""
+        process = getattr(self.calc, "process", None)
+        return process is None or process.poll() is None
+
+    def close(self):
+        """Stop the running process, if any."""
+        if self.calc is not None:
+            if not self._alive():
+                # VaspInteractive.close would write to the pipe of a dead process.
+                self.calc.process = None
+            try:
+                self.calc.close()
+            except Exception as e:
+                logging.error(f"\t\tError in closing {self.calculator} session: {str(e)}")
+                process = getattr(self.calc, "process", None)
+                if process is not None:
+                    process.kill()
+                    self.calc.process = None
+            if isinstance(self.calc, VaspInteractive) and self.calc.txt is not None:
+                self.calc.txt.close()
+        self.calc = None
+        self.key = None
+
+    def _evaluate(self, atoms, label, calc_type):
+        if (
+            self.calc is None
+            or self.key != self.session_key(atoms)
+            or not self._alive()
+        ):
+            self.close()
+            self._launch(atoms)
+
+        atoms.calc = self.calc
+        if calc_type.lower() == "opt":
+            opt = BFGS(atoms, logfile=f"{label}.log")
+            if not opt.run(fmax=FMAX[self.calculator], steps=500):
+                raise RuntimeError(f"Optimization of {label} did not converge in 500 steps")
+
+        atoms.get_potential_energy()
+        atoms.get_forces()
+
+        return {
+            key: value
+            for key, value in self.calc.results.items()
+            if key in RESULT_PROPERTIES
+        }
+
+    def run(self, atoms, label, calc_type):
+        """
+        Run a single-point or atomic optimization in the session.
+
+        Args:
+            atoms (ase.Atoms): The atomic structure for the calculation.
+            label (str): Label for the calculation.
+            calc_type (str): Type of calculation, either 'opt' or 'sp'.
+
+        Returns:
+            ase.Atoms: The atomic structure with calculation results.
+        """
+
+        try:
+            results = self._evaluate(atoms, label, calc_type)
+        except (OSError, RuntimeError) as e:
+            # VaspInteractive raises RuntimeError when VASP exits; other
+            # RuntimeErrors (e.g. unconverged optimizations) are real failures.
+            if isinstance(e, RuntimeError) and self._alive():
+                raise
+            logging.error(f"\t\tLost {self.calculator} session, reconnecting: {str(e)}")
+            self.close()
+            results = self._evaluate(atoms, label, calc_type)
+
+        # Detach the results from the live process before the next geometry.
+        opt_atoms = atoms.copy()
+        opt_atoms.calc = SinglePointCalculator(opt_atoms, **results)
+
+        return opt_atoms
@@ -0,0 +1,300 @@
+# coding=utf-8
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import numpy as np
+from ase.utils.filecache import MultiFileJSONCache
+from ase.vibrations import VibrationsData
+
+try:
+    import spglib
+except ImportError:
+    spglib = None
+
+
+def displacement_name(index, direction, sign):
+    """Return the cache name of a displacement, e.g. '3x+'."""
+    return f"{index}{'xyz'[direction]}{'+' if sign > 0 else '-'}"
+
+
+def symmetry_operations(atoms, symprec=1e-3):
+    """
+    Find the symmetry operations of a periodic structure.
+
+    Args:
+        atoms (ase.Atoms): The atomic structure.
+        symprec (float): Symmetry tolerance passed to spglib.
+
+    Returns:
+        list: (rotation, permutation) pairs, where rotation is the Cartesian
+        rotation matrix and permutation[a] is the image of atom a. Empty if
+        spglib is not installed or the structure is not periodic.
+    """
+
+    if spglib is None or not atoms.pbc.all():
+        return []
+
+    scaled = atoms.get_scaled_positions()
+    symmetry = spglib.get_symmetry(
+        (atoms.cell.array, scaled, atoms.numbers), symprec=symprec
+    )
+    if symmetry is None:
+        return []
+
+    lattice = atoms.cell.array.T
+    inverse_lattice = np.linalg.inv(lattice)
+    operations = []
+    for rotation, translation in zip(symmetry["rotations"], symmetry["translations"]):
+        diff = (scaled @ rotation.T + translation)[:, None, :] - scaled[None, :, :]
+        diff -= np.round(diff)
+        distances = np.linalg.norm(diff @ atoms.cell.array, axis=2)
+        operations.append((lattice @ rotation @ inverse_lattice, distances.argmin(axis=1)))
+
+    return operations
+
+
+def plan_displacements(n_atoms, operations):
+    """
+    Select the atoms that have to be displaced explicitly.
+
+    Atoms that are images of a displaced atom under a symmetry operation are
+    derived by rotating its Hessian rows. One remaining atom without images is
+    derived from translational invariance (the rows of all atoms sum to zero).
+
+    Args:
+        n_atoms (int): Number of atoms.
+        operations (list): Symmetry operations from symmetry_operations.
+
+    Returns:
+        tuple: (displaced atoms, {derived atom: (source atom, rotation, permutation)},
+        atom derived from translational invariance or None).
+    """
+
+    displaced = []
+    derived = {}
+    for a in range(n_atoms):
+        if a in derived or a in displaced:
+            continue
+        displaced.append(a)
+        for rotation, permutation in operations:
+            b = permutation[a]
+            if b not in derived and b not in displaced:
+                derived[b] = (a, rotation, permutation)
+
+    sources = {source for source, _, _ in derived.values()}
+    candidates = [a for a in displaced if a not in sources]
+    acoustic = candidates[-1] if candidates and len(displaced) > 1 else None
+    if acoustic is not None:
+        displaced.remove(acoustic)
+
+    return displaced, derived, acoustic
+
+
+def available_cpus():
+    """Return the number of CPUs of the allocation (SLURM_CPUS_PER_TASK or all CPUs)."""
+    return int(os.environ.get("SLURM_CPUS_PER_TASK", os.cpu_count()))
+
+
+@contextmanager
+def _limited_threads(threads):
+    """
+    Set the OpenMP/BLAS thread limits inherited by newly started workers.
+
+    The limits are read when a library is loaded, so they have to be in the
+    environment the worker starts with; setting them in an already running
+    process (e.g. after tblite was used in the parent) has no effect.
+    """
+
+    variables = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+    previous = {variable: os.environ.get(variable) for variable in variables}
+    os.environ.update({variable: str(threads) for variable in variables})
+    try:
+        yield
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable)
+            else:
+                os.environ[variable] = value
+
+
+def _reference(atoms, delta):
+    """Return what the cached forces depend on besides the displacement name."""
+    return {
+        "delta": delta,
+        "numbers": atoms.numbers,
+        "positions": atoms.positions,
+        "cell": atoms.cell.array,
+    }
+
+
+def _matches(reference, atoms, delta):
+    """Return whether a cached reference belongs to these atoms and delta."""
+    return (
+        reference is not None
+        and reference["delta"] == delta
+        and np.array_equal(reference["numbers"], atoms.numbers)
+        and np.allclose(reference["positions"], atoms.positions, rtol=0, atol=1e-8)
+        and np.allclose(reference["cell"], atoms.cell.array, rtol=0, atol=1e-8)
+    )
+
+
+def _displaced_forces(evaluate, atoms, name, directory):
+    """Evaluate one displacement in its own working directory."""
+    os.makedirs(directory, exist_ok=True)
+    os.chdir(directory)
+    result, error = evaluate(atoms=atoms, label=name)
+
+    return (None, error) if result is None else (result.get_forces(), None)
+
+
+def run_vibrations(
+    atoms, evaluate, delta=0.01, workers=None, symprec=1e-3, directory="vib"
+):
+    """
+    Run a central finite-difference vibrational analysis.
+
+    The displaced single points are evaluated in parallel over a pool of
+    freshly started (spawned) processes, each in its own folder under
+    directory, and the CPUs are split evenly between the workers through
+    OMP_NUM_THREADS. Forces are cached in directory/cache, so an interrupted
+    run resumes with the remaining displacements. The cache is discarded if it
+    was made for other positions or another delta.
+
+    Args:
+        atoms (ase.Atoms): The reference (optimized) structure.
+        evaluate (callable): Called as evaluate(atoms=..., label=...) and
+            returning the atoms with forces (or None) and an error message.
+            It must be picklable, i.e. defined at module level.
+        delta (float): Displacement in Å.
+        workers (int): Number of worker processes (Default: available_cpus()).
+        symprec (float): Symmetry tolerance.
+        directory (str): Folder for the displacements and the cache.
+
+    Returns:
+        ase.vibrations.VibrationsData: Hessian, frequencies and modes.
+    """
+
+    n_atoms = len(atoms)
+    vib_dir = os.path.abspath(directory)
+    cache = MultiFileJSONCache(os.path.join(vib_dir, "cache"))
+    cache.strip_empties()
+    if "reference" in cache and not _matches(cache["reference"], atoms, delta):
+        logging.warning(
+            f"\t\tDiscarding {vib_dir}/cache made for other positions or delta"
+        )
+        cache.clear()
+    if "reference" not in cache:
+        cache["reference"] = _reference(atoms, delta)
+
+    displaced, derived, acoustic = plan_displacements(
+        n_atoms, symmetry_operations(atoms, symprec)
+    )
+    logging.info(
+        f"\t\tDisplacing {len(displaced)} of {n_atoms} atoms "
+        f"({len(derived)} from symmetry, "
+        f"{0 if acoustic is None else 1} from translational invariance)"
+    )
+
+    displacements = {}
+    for a in displaced:
+        for i in range(3):
+            for sign in (-1, 1):
+                name = displacement_name(a, i, sign)
+                if name in cache:
+                    continue
+                displaced_atoms = atoms.copy()
+                displaced_atoms.positions[a, i] += sign * delta
+                displacements[name] = displaced_atoms
+
+    logging.info(f"\t\t{len(displacements)} displacements left to evaluate")
+
+    if workers is None:
+        workers = available_cpus()
+    workers = max(1, min(workers, len(displacements)))
+
+    failed = []
+    if displacements:
+        with _limited_threads(max(1, available_cpus() // workers)), ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as pool:
+            futures = {
+                pool.submit(
+                    _displaced_forces,
+                    evaluate,
+                    displaced_atoms,
+                    name,
+                    os.path.join(vib_dir, name),
+                ): name
+                for name, displaced_atoms in displacements.items()
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                forces, error = future.result()
+                if forces is None:
+                    logging.error(f"\t\tError in displacement {name}: {error}")
+                    failed.append(name)
+                else:
+                    cache[name] = {"forces": forces}
+
+    if failed:
+        raise RuntimeError(f"Failed displacements: {', '.join(sorted(failed))}")
+
+    hessian = np.zeros((n_atoms, 3, n_atoms, 3))
+    for a in displaced:
+        for i in range(3):
+            forces_minus = np.asarray(cache[displacement_name(a, i, -1)]["forces"])
+            forces_plus = np.asarray(cache[displacement_name(a, i, 1)]["forces"])
+            hessian[a, i] = (forces_minus - forces_plus) / (2 * delta)
+
+    # H[perm(a), :, perm(c), :] = R H[a, :, c, :] R^T
+    for b, (a, rotation, permutation) in derived.items():
+        rotated = np.einsum("ij,jck,lk->icl", rotation, hessian[a], rotation)
+        hessian[b][:, permutation] = rotated
+
+    if acoustic is not None:
+        hessian[acoustic] = -hessian.sum(axis=0)
+
+    hessian = hessian.reshape(3 * n_atoms, 3 * n_atoms)
+    hessian = 0.5 * (hessian + hessian.T)
+
+    return VibrationsData.from_2d(atoms, hessian)
+
+
+def compact_data(vib_data, delta=0.01):
+    """
+    Pack vibrational results for storage in the row data of a database.
+
+    Args:
+        vib_data (ase.vibrations.VibrationsData): Results from run_vibrations.
+        delta (float): Displacement used in Å.
+
+    Returns:
+        dict: The upper triangle of the Hessian in eV/Å^2 (see unpack_hessian),
+        the frequencies in cm^-1 (imaginary frequencies as negative numbers)
+        and the normal modes in single precision.
+    """
+
+    hessian = vib_data.get_hessian_2d()
+    frequencies = vib_data.get_frequencies()
+
+    return {
+        "vib_hessian": hessian[np.triu_indices(len(hessian))],
+        "vib_frequencies": frequencies.real - np.abs(frequencies.imag),
+        "vib_modes": vib_data.get_modes().astype(np.float32),
+        "vib_delta": delta,
+    }
+
+
+def unpack_hessian(packed):
+    """Rebuild the full Hessian from the upper triangle stored by compact_data."""
+    size = int((np.sqrt(8 * len(packed) + 1) - 1) / 2)
+    hessian = np.zeros((size, size))
+    hessian[np.triu_indices(size)] = packed
+
+    return hessian + np.triu(hessian, 1).T
@@ -36,6 +36,10 @@ python ./calculation/opt.py $(cat <<EOF
     job.encut=500
     job.lattice_opt="no"
     job.calc_type=opt
+    job.vib_delta=0.01
+    job.retry=end
+    job.max_retries=2
+    job.session=False
     paths.output_path=
     paths.db_path=/home/felicia/Cellulose/calculations/DFTB/DFTB_crystals/beta/beta_B/db
     paths.input_db_name=$db_file
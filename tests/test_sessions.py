@@ -0,0 +1,212 @@
+# coding=utf-8
+
+import os
+import socket
+import sys
+import threading
+
+import pytest
+from ase import Atoms
+from ase.calculators.emt import EMT
+from ase.calculators.socketio import SocketClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "calculation"))
+
+import sessions  # noqa: E402
+
+
+class ThreadClient:
+    """Stand-in for a dftb+ process: an EMT SocketClient running in a thread."""
+
+    def __init__(self, atoms, unixsocket):
+        self.client = None
+        self.connected = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(atoms, unixsocket))
+        self.thread.start()
+
+    def _run(self, atoms, unixsocket):
+        atoms.calc = EMT()
+        self.client = SocketClient(unixsocket=unixsocket)
+        self.connected.set()
+        self.client.run(atoms)
+
+    def kill(self):
+        """Drop the connection as if the process had died."""
+        self.connected.wait()
+        self.client.protocol.socket.shutdown(socket.SHUT_RDWR)
+        self.thread.join()
+
+    def poll(self):
+        return None if self.thread.is_alive() else 0
+
+    def wait(self):
+        self.thread.join()
+        return 0
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    session = sessions.CalculatorSession("dftb")
+    session.clients = []
+
+    def launch_client(atoms, properties, port=None, unixsocket=None):
+        client = ThreadClient(atoms.copy(), unixsocket)
+        session.clients.append(client)
+        return client
+
+    session.launch_client = launch_client
+    yield session
+    session.close()
+
+
+def trimer(symbols):
+    return Atoms(symbols, positions=[(0, 0, 0), (2.6, 0, 0), (1.2, 2.1, 0.3)])
+
+
+def emt_energy(atoms):
+    atoms = atoms.copy()
+    atoms.calc = EMT()
+    return atoms.get_potential_energy()
+
+
+def test_reuses_process_for_same_atoms(session):
+    first = trimer("CuAuAg")
+    second = trimer("CuAuAg")
+    second.rattle(0.05, seed=1)
+
+    for atoms in (first, second):
+        result = session.run(atoms.copy(), "test", "sp")
+        assert result.get_potential_energy() == pytest.approx(emt_energy(atoms))
+
+    assert len(session.clients) == 1
+
+
+def test_relaunches_on_atom_order_change(session):
+    first = trimer("CuAuAg")
+    reordered = trimer("AgCuAu")
+
+    session.run(first.copy(), "test", "sp")
+    result = session.run(reordered.copy(), "test", "sp")
+
+    assert len(session.clients) == 2
+    assert result.get_potential_energy() == pytest.approx(emt_energy(reordered))
+
+
+def test_reconnects_after_client_dies(session):
+    first = trimer("CuAuAg")
+    second = trimer("CuAuAg")
+    second.rattle(0.05, seed=1)
+
+    session.run(first.copy(), "test", "sp")
+    session.clients[0].kill()
+    result = session.run(second.copy(), "test", "sp")
+
+    assert len(session.clients) == 2
+    assert result.get_potential_energy() == pytest.approx(emt_energy(second))
+
+
+FAKE_VASP = """
+import os
+import sys
+
+from ase.calculators.emt import EMT
+from ase.io import read, write
+
+atoms = read("start.traj")
+atoms.calc = EMT()
+stops = 0
+while True:
+    atoms.get_potential_energy()
+    atoms.get_forces()
+    atoms.get_stress()
+    write("vasprun.xml", atoms, format="extxyz")
+    print("POSITIONS: reading from stdin", flush=True)
+    if stops == 2:
+        sys.exit(0)
+
+    lines = [sys.stdin.readline() for _ in range(len(atoms))]
+    if not all(lines):
+        sys.exit(1)
+    if os.path.exists("../die"):
+        os.remove("../die")
+        sys.exit(1)
+    if os.path.exists("STOPCAR"):
+        stops += 1
+    atoms.set_scaled_positions([[float(x) for x in line.split()] for line in lines])
+"""
+
+
+@pytest.fixture
+def vasp_session(tmp_path, monkeypatch):
+    """A VASP session running an EMT script that speaks VASP's interactive mode."""
+    import ase.io
+    from ase.calculators.vasp import interactive
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "fake_vasp.py").write_text(FAKE_VASP)
+
+    def write_input(self, atoms, directory="./"):
+        ase.io.write(os.path.join(directory, "start.traj"), atoms)
+
+    def initialize(self, atoms):
+        self.atoms = atoms
+        self.sort = self.resort = list(range(len(atoms)))
+
+    monkeypatch.setattr(interactive.VaspInteractive, "write_input", write_input)
+    monkeypatch.setattr(interactive.VaspInteractive, "initialize", initialize)
+    monkeypatch.setattr(
+        interactive, "read", lambda path, index: ase.io.read(path, index, "extxyz")
+    )
+
+    session = sessions.CalculatorSession(
+        "vasp", functional="PBE", vasp_command=f"{sys.executable} ../fake_vasp.py"
+    )
+    yield session
+    session.close()
+
+
+def boxed_trimer():
+    atoms = trimer("Cu3")
+    atoms.center(vacuum=4.0)
+    atoms.pbc = True
+    return atoms
+
+
+def test_vasp_reuses_process(vasp_session):
+    first = boxed_trimer()
+    second = boxed_trimer()
+    second.rattle(0.05, seed=1)
+
+    for atoms in (first, second):
+        result = vasp_session.run(atoms.copy(), "test", "sp")
+        assert result.get_potential_energy() == pytest.approx(emt_energy(atoms))
+
+    assert vasp_session.launches == 1
+
+
+def test_vasp_relaunches_dead_process(vasp_session):
+    first = boxed_trimer()
+    second = boxed_trimer()
+    second.rattle(0.05, seed=1)
+
+    vasp_session.run(first.copy(), "test", "sp")
+    vasp_session.calc.process.kill()
+    vasp_session.calc.process.wait()
+    result = vasp_session.run(second.copy(), "test", "sp")
+
+    assert vasp_session.launches == 2
+    assert result.get_potential_energy() == pytest.approx(emt_energy(second))
+
+
+def test_vasp_reconnects_when_process_dies_mid_step(vasp_session, tmp_path):
+    first = boxed_trimer()
+    second = boxed_trimer()
+    second.rattle(0.05, seed=1)
+
+    vasp_session.run(first.copy(), "test", "sp")
+    (tmp_path / "die").touch()
+    result = vasp_session.run(second.copy(), "test", "sp")
+
+    assert vasp_session.launches == 2
+    assert result.get_potential_energy() == pytest.approx(emt_energy(second))
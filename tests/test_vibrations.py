@@ -0,0 +1,122 @@
+# coding=utf-8
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from ase import Atoms
+from ase.calculators.emt import EMT
+from ase.vibrations import Vibrations
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "calculation"))
+
+import vibrations  # noqa: E402
+
+
+def emt_evaluate(atoms, label):
+    """Stand-in for run_calc returning (atoms, error)."""
+    atoms.calc = EMT()
+    atoms.get_forces()
+    return atoms, None
+
+
+def failing_evaluate(atoms, label):
+    return None, "not expected to run"
+
+
+def xtb_evaluate(atoms, label):
+    """In-process xTB single point that also reports the worker's thread limit."""
+    import calculators
+
+    assert os.environ["OMP_NUM_THREADS"] == "2"
+    return calculators.xTB_calculator(atoms, label, "sp", "GFN2", "no"), None
+
+
+def trimer():
+    return Atoms("Cu3", positions=[(0, 0, 0), (2.5, 0, 0), (1.2, 2.2, 0.2)])
+
+
+def ase_hessian(atoms, delta, directory):
+    atoms = atoms.copy()
+    atoms.calc = EMT()
+    vib = Vibrations(atoms, name=str(directory), delta=delta)
+    vib.run()
+    return vib.get_vibrations().get_hessian_2d()
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_hessian_matches_ase(workdir):
+    atoms = trimer()
+    vib_data = vibrations.run_vibrations(atoms, emt_evaluate, delta=0.01, workers=2)
+
+    reference = ase_hessian(atoms, 0.01, workdir / "ase")
+    assert np.allclose(vib_data.get_hessian_2d(), reference, atol=1e-3)
+
+
+def test_cache_is_discarded_for_other_delta_or_positions(workdir):
+    atoms = trimer()
+    vibrations.run_vibrations(atoms, emt_evaluate, delta=0.01, workers=2)
+
+    vib_data = vibrations.run_vibrations(atoms, emt_evaluate, delta=0.02, workers=2)
+    reference = ase_hessian(atoms, 0.02, workdir / "ase_delta")
+    assert np.allclose(vib_data.get_hessian_2d(), reference, atol=1e-3)
+
+    atoms.rattle(0.1, seed=1)
+    vib_data = vibrations.run_vibrations(atoms, emt_evaluate, delta=0.02, workers=2)
+    reference = ase_hessian(atoms, 0.02, workdir / "ase_moved")
+    assert np.allclose(vib_data.get_hessian_2d(), reference, atol=1e-3)
+
+
+def test_cache_is_reused_from_another_directory(workdir):
+    atoms = trimer()
+    vib_dir = workdir / "outputs" / "1_Cu3" / "vib"
+    first = vibrations.run_vibrations(atoms, emt_evaluate, workers=2, directory=vib_dir)
+
+    # As in a retry: another working directory, but the original vib folder.
+    os.makedirs(workdir / "retry_1")
+    os.chdir(workdir / "retry_1")
+    second = vibrations.run_vibrations(
+        atoms, failing_evaluate, workers=2, directory=vib_dir
+    )
+
+    assert np.allclose(second.get_hessian_2d(), first.get_hessian_2d())
+
+
+def test_parallel_xtb_matches_serial(workdir, monkeypatch):
+    pytest.importorskip("tblite")
+    from tblite.ase import TBLite
+
+    import calculators
+
+    atoms = Atoms("OH2", positions=[(0, 0, 0.12), (0, 0.76, -0.48), (0, -0.76, -0.48)])
+    atoms = calculators.xTB_calculator(atoms, "water", "opt", "GFN2", "no")
+    atoms.calc = None
+
+    # tblite has run in this process before the pool starts, as in run_vib.
+    monkeypatch.setenv("SLURM_CPUS_PER_TASK", "4")
+    vib_data = vibrations.run_vibrations(atoms, xtb_evaluate, workers=2)
+
+    reference = atoms.copy()
+    reference.calc = TBLite(method="GFN2-xTB", verbosity=0)
+    vib = Vibrations(reference, name=str(workdir / "ase"), delta=0.01)
+    vib.run()
+    # The SCF noise in the derived rows is small against the stretching modes.
+    assert np.allclose(
+        vib_data.get_frequencies()[-3:].real,
+        vib.get_frequencies()[-3:].real,
+        atol=1.0,
+    )
+
+
+def test_packed_hessian_roundtrip():
+    hessian = np.random.default_rng(0).random((9, 9))
+    hessian = hessian + hessian.T
+    packed = hessian[np.triu_indices(9)]
+
+    assert np.allclose(vibrations.unpack_hessian(packed), hessian)
@@ -0,0 +1,103 @@
+# coding=utf-8
+
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+from ase.build import molecule
+from ase.db import connect
+
+pytest.importorskip("tblite")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "calculation"))
+
+import calculators  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def water():
+    atoms = molecule("H2O")
+    atoms.positions[0] += (0.0, 0.0, 0.15)
+    return atoms
+
+
+def test_sp_returns_energy_forces_and_charges():
+    atoms = calculators.xTB_calculator(water(), "water", "sp", "GFN2", "no")
+
+    assert np.isfinite(atoms.get_potential_energy())
+    assert atoms.get_forces().shape == (3, 3)
+    charges = atoms.get_charges()
+    assert charges.shape == (3,)
+    assert charges.sum() == pytest.approx(0.0, abs=1e-6)
+
+
+@pytest.mark.parametrize("settings", calculators.ESCALATION_LADDERS["xtb"])
+def test_escalation_settings_are_accepted(settings):
+    reference = calculators.xTB_calculator(water(), "water", "sp", "GFN2", "no")
+    atoms = calculators.xTB_calculator(water(), "water", "sp", "GFN2", "no", settings)
+
+    # The ladder only changes SCF convergence aids, not the electronic structure.
+    assert atoms.get_potential_energy() == pytest.approx(
+        reference.get_potential_energy(), abs=1e-5
+    )
+
+
+def test_opt_converges():
+    atoms = calculators.xTB_calculator(water(), "water", "opt", "GFN2", "no")
+
+    assert np.linalg.norm(atoms.get_forces(), axis=1).max() < 0.005
+
+
+def test_unconverged_opt_lands_in_retry_queue(workdir, monkeypatch):
+    pytest.importorskip("hydra")
+    import calc
+
+    class OneStepBFGS(calculators.BFGS):
+        def run(self, fmax, steps):
+            return super().run(fmax=fmax, steps=1)
+
+    monkeypatch.setattr(calculators, "BFGS", OneStepBFGS)
+    opt_db = connect(workdir / "opt.db")
+    input_atoms = water()
+
+    converged = calc.optimize_atoms(
+        input_atom=input_atoms,
+        row=None,
+        opt_db=opt_db,
+        calculator="xTB",
+        calc_type="opt",
+        calculation_label="1_water",
+        functional=None,
+        dispersion_correction=None,
+        basis_set=None,
+        parametrization="GFN2",
+        kpoints=(),
+        cutoff=None,
+        lattice_opt="no",
+        counter=1,
+    )
+
+    assert not converged
+    row = opt_db.get(name="1_water")
+    assert not row.converged
+    assert row.get("energy") is None
+    assert np.allclose(row.positions, input_atoms.positions)
+    assert "did not converge" in row.data["attempts"][0]["error"]
+
+
+@pytest.mark.skipif(shutil.which("dftb+") is None, reason="DFTB+ is not installed")
+def test_sp_matches_dftb():
+    reference = calculators.DFTB_calculator(water(), "water", "sp", "GFN2", (), "no")
+    atoms = calculators.xTB_calculator(water(), "water", "sp", "GFN2", "no")
+
+    assert atoms.get_potential_energy() == pytest.approx(
+        reference.get_potential_energy(), abs=1e-3
+    )
+    assert np.allclose(atoms.get_forces(), reference.get_forces(), atol=1e-3)